@@ -0,0 +1,207 @@
+"""On-disk caches that let repeated questions skip the search, fetch and generation steps."""
+
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import orjson
+from llama_index.embeddings.openai import OpenAIEmbedding
+from llama_index.embeddings.openai.base import aget_embeddings
+from openai import AsyncOpenAI
+from platformdirs import user_cache_dir
+
+CACHE_DIR = Path(user_cache_dir("cli_search"))
+SIMILARITY_THRESHOLD = 0.95
+ANSWER_TTL = 24 * 60 * 60
+EMBEDDING_TTL = 30 * 24 * 60 * 60
+MAX_CACHED_EMBEDDINGS = 100_000
+PAGE_TTL = 60 * 60
+PAGE_RETENTION = 7 * 24 * 60 * 60
+SEARCH_TTL = 60 * 60
+
+
+class CachedPage(NamedTuple):
+    text: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fresh: bool
+
+
+_local = threading.local()
+
+
+def _connect() -> sqlite3.Connection:
+    """Open this thread's connection to the cache database, creating its schema on first use."""
+    if conn := getattr(_local, "conn", None):
+        return conn
+
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    conn = _local.conn = sqlite3.connect(CACHE_DIR / "cache.sqlite3")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS answers ("
+        "id INTEGER PRIMARY KEY, model TEXT, question TEXT, answer TEXT, embedding BLOB, ts INTEGER)"
+    )
+    conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, embedding BLOB, ts INTEGER)")
+    conn.execute("CREATE INDEX IF NOT EXISTS embeddings_ts ON embeddings (ts)")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS pages (url TEXT PRIMARY KEY, text TEXT, etag TEXT, last_modified TEXT, ts INTEGER)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS pages_ts ON pages (ts)")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS searches ("
+        "query TEXT, num_results INTEGER, results TEXT, ts INTEGER, PRIMARY KEY (query, num_results))"
+    )
+    return conn
+
+
+def _quantize(embedding: List[float]) -> np.ndarray:
+    """Scale an embedding to unit length and store each component as an int8."""
+    vector = np.asarray(embedding, dtype=np.float32)
+    return np.round(vector * (127 / np.linalg.norm(vector))).astype(np.int8)
+
+
+def lookup_answer(embedding: List[float], model: str) -> Optional[str]:
+    """Return the cached answer for the most similar earlier question, if it is similar enough."""
+    rows = (
+        _connect()
+        .execute(
+            "SELECT answer, embedding FROM answers WHERE model = ? AND ts >= ?",
+            (model, int(time.time()) - ANSWER_TTL),
+        )
+        .fetchall()
+    )
+    if not rows:
+        return None
+
+    matrix = np.frombuffer(b"".join(row[1] for row in rows), dtype=np.int8).reshape(len(rows), -1)
+    scores = (matrix.astype(np.int32) @ _quantize(embedding).astype(np.int32)) / 127**2
+    best = int(scores.argmax())
+    return rows[best][0] if scores[best] >= SIMILARITY_THRESHOLD else None
+
+
+def store_answer(question: str, embedding: List[float], model: str, answer: str) -> None:
+    """Cache an answer under its question embedding and drop expired entries."""
+    now = int(time.time())
+    conn = _connect()
+    with conn:
+        conn.execute("DELETE FROM answers WHERE ts < ?", (now - ANSWER_TTL,))
+        conn.execute(
+            "INSERT INTO answers (model, question, answer, embedding, ts) VALUES (?, ?, ?, ?, ?)",
+            (model, question, answer, _quantize(embedding).tobytes(), now),
+        )
+
+
+def load_embeddings(keys: List[str]) -> Dict[str, List[float]]:
+    """Return the unexpired cached embeddings among the given keys."""
+    placeholders = ",".join("?" * len(keys))
+    rows = _connect().execute(
+        f"SELECT key, embedding FROM embeddings WHERE key IN ({placeholders}) AND ts >= ?",
+        (*keys, int(time.time()) - EMBEDDING_TTL),
+    )
+    return {key: np.frombuffer(blob, dtype=np.float32).tolist() for key, blob in rows}
+
+
+def save_embeddings(embeddings: Dict[str, List[float]]) -> None:
+    """Cache embeddings by key, evicting expired entries and the oldest ones beyond the size cap."""
+    now = int(time.time())
+    conn = _connect()
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, embedding, ts) VALUES (?, ?, ?)",
+            [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in embeddings.items()],
+        )
+        conn.execute("DELETE FROM embeddings WHERE ts < ?", (now - EMBEDDING_TTL,))
+        (count,) = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        if count > MAX_CACHED_EMBEDDINGS:
+            conn.execute(
+                "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY ts LIMIT ?)",
+                (count - MAX_CACHED_EMBEDDINGS,),
+            )
+
+
+def load_page(url: str) -> Optional[CachedPage]:
+    """Return the cached text and validators for a URL, if it was fetched before."""
+    row = _connect().execute("SELECT text, etag, last_modified, ts FROM pages WHERE url = ?", (url,)).fetchone()
+    if row is None:
+        return None
+    text, etag, last_modified, ts = row
+    return CachedPage(text, etag, last_modified, fresh=time.time() - ts < PAGE_TTL)
+
+
+def save_page(url: str, text: str, etag: Optional[str], last_modified: Optional[str]) -> None:
+    """Cache the cleaned text of a page together with its HTTP validators and drop long-unused pages."""
+    now = int(time.time())
+    conn = _connect()
+    with conn:
+        conn.execute("DELETE FROM pages WHERE ts < ?", (now - PAGE_RETENTION,))
+        conn.execute(
+            "INSERT OR REPLACE INTO pages (url, text, etag, last_modified, ts) VALUES (?, ?, ?, ?, ?)",
+            (url, text, etag, last_modified, now),
+        )
+
+
+def touch_page(url: str) -> None:
+    """Mark a cached page as freshly revalidated."""
+    conn = _connect()
+    with conn:
+        conn.execute("UPDATE pages SET ts = ? WHERE url = ?", (int(time.time()), url))
+
+
+def load_search(query: str, num_results: int) -> Optional[List[str]]:
+    """Return the unexpired cached result URLs for a normalized query."""
+    row = (
+        _connect()
+        .execute(
+            "SELECT results FROM searches WHERE query = ? AND num_results = ? AND ts >= ?",
+            (query, num_results, int(time.time()) - SEARCH_TTL),
+        )
+        .fetchone()
+    )
+    return orjson.loads(row[0]) if row else None
+
+
+def save_search(query: str, num_results: int, results: List[str]) -> None:
+    """Cache the result URLs for a normalized query and drop expired entries."""
+    now = int(time.time())
+    conn = _connect()
+    with conn:
+        conn.execute("DELETE FROM searches WHERE ts < ?", (now - SEARCH_TTL,))
+        conn.execute(
+            "INSERT OR REPLACE INTO searches (query, num_results, results, ts) VALUES (?, ?, ?, ?)",
+            (query, num_results, orjson.dumps(results), now),
+        )
+
+
+class CachedEmbedding(OpenAIEmbedding):
+    """OpenAI embedding model that reuses on-disk vectors for texts it has embedded before."""
+
+    def _cache_key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}|{text}".encode()).hexdigest()
+
+    def _lookup(self, texts: List[str]) -> Tuple[Dict[str, List[float]], List[str]]:
+        cached = load_embeddings([self._cache_key(text) for text in texts])
+        return cached, [text for text in texts if self._cache_key(text) not in cached]
+
+    def _remember(self, cached: Dict[str, List[float]], texts: List[str], embeddings: List[List[float]]) -> None:
+        fresh = {self._cache_key(text): vector for text, vector in zip(texts, embeddings)}
+        save_embeddings(fresh)
+        cached.update(fresh)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        cached, missing = self._lookup(texts)
+        if missing:
+            self._remember(cached, missing, super()._get_text_embeddings(missing))
+        return [cached[self._cache_key(text)] for text in texts]
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        cached, missing = self._lookup(texts)
+        if missing:
+            # Async connections belong to the running loop, so each call opens and closes its own client on it.
+            async with AsyncOpenAI(**self._get_credential_kwargs(is_async=True)) as aclient:
+                embeddings = await aget_embeddings(aclient, missing, engine=self._text_engine, **self.additional_kwargs)
+            self._remember(cached, missing, embeddings)
+        return [cached[self._cache_key(text)] for text in texts]
@@ -1,23 +1,60 @@
 """CLI search bot that processes questions and provides answers using LlamaIndex."""
 
+from __future__ import annotations
+
+import atexit
+import codecs
 import logging
 import os
+import re
 import sys
-from typing import List, Set
+import threading
+from functools import cache
+from typing import TYPE_CHECKING, Any, Callable, Iterable, List, Optional, Set
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
 import click
-import requests
-import urllib3
-from bs4 import BeautifulSoup
-from llama_index.core import Document, Settings, VectorStoreIndex
-from llama_index.core.node_parser import SentenceSplitter
-from llama_index.core.query_engine import CitationQueryEngine
-from llama_index.llms.openai import OpenAI
 
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+if TYPE_CHECKING:
+    from concurrent.futures import Future, ThreadPoolExecutor
+
+    import aiohttp
+    import httpx
+    import requests
+    from llama_index.core import Document
+    from llama_index.core.node_parser import SentenceSplitter
+    from llama_index.llms.openai import OpenAI
+    from lxml import etree
+
+    from cli_search.cache import CachedEmbedding
 
 DEFAULT_LOG_LEVEL = "WARNING"
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+MAX_DOCUMENT_CHARS = 10000
+MAX_PAGE_BYTES = 512 * 1024
+SMALL_CORPUS_CHARS = 8000
+MIN_QUESTION_CHARS = 3
+EMBED_MODEL = "text-embedding-3-small"
+EMBED_DIM = 1536
+SEARCH_TIMEOUT = (3.05, 10)
+BOMS = (
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+META_CHARSET = re.compile(rb"""<meta[^>]+charset\s*=\s*["']?([\w-]+)""", re.IGNORECASE)
+PUNCTUATION_ONLY = re.compile(r"[^\w]+")
+WHITESPACE = re.compile(r"\s+")
+RESULT_LINK_CLASSES = {"result__a", "result__url"}
+ANSWER_TEMPLATE = "{answer}\n\nSources:\n{sources}"
+SOURCE_TEMPLATE = "{i}. {url}\n"
+TRACKING_PARAMS = {"fbclid", "gclid"}
+SKIPPED_HOSTS = re.compile(r"(?:^|\.)(?:facebook\.com|instagram\.com|x\.com|linkedin\.com)$")
+USER_AGENT = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"  # noqa: E501
+HEADERS = {"User-Agent": USER_AGENT}
+SEARCH_URL = "https://duckduckgo.com/html/"
 
 logging.basicConfig(
     level=DEFAULT_LOG_LEVEL,
@@ -27,110 +64,380 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def search_web(query: str, num_results: int = 3) -> List[str]:
-    """Perform a web search and return a list of URLs."""
-    search_url = "https://duckduckgo.com/html/"
-    params = {"q": query}
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",  # noqa: E501
-    }
+@cache
+def _session() -> requests.Session:
+    """Build the pooled, retrying HTTP session shared by all web searches."""
+    import requests
+    import urllib3
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    session.verify = False
+    adapter = HTTPAdapter(
+        pool_connections=10,
+        pool_maxsize=20,
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.3,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["GET"],
+        ),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    atexit.register(session.close)
+    return session
+
+
+@cache
+def _http_client() -> httpx.Client:
+    """Build the keep-alive HTTP client shared by all synchronous OpenAI calls."""
+    import httpx
+
+    return httpx.Client(limits=httpx.Limits(max_keepalive_connections=20))
+
+
+@cache
+def _get_llm() -> OpenAI:
+    """Build the answering LLM once per process."""
+    from llama_index.llms.openai import OpenAI
+
+    return OpenAI(model="gpt-4o", api_key=OPENAI_API_KEY, http_client=_http_client())
+
+
+@cache
+def _get_embed_model() -> CachedEmbedding:
+    """Build the caching embedding model once per process."""
+    from cli_search.cache import CachedEmbedding
+
+    return CachedEmbedding(
+        model=EMBED_MODEL,
+        embed_batch_size=100,
+        num_workers=4,
+        api_key=OPENAI_API_KEY,
+        http_client=_http_client(),
+    )
+
+
+@cache
+def _get_splitter() -> SentenceSplitter:
+    """Build the node parser once per process."""
+    from llama_index.core.node_parser import SentenceSplitter
+
+    return SentenceSplitter(chunk_size=1024)
 
-    try:
-        response = requests.get(search_url, params=params, headers=headers, verify=False)
-        response.raise_for_status()
 
-        soup = BeautifulSoup(response.text, "html.parser")
-        results = []
+def _normalize_url(url: str) -> str:
+    """Build a URL's de-duplication key by lower-casing the host and dropping the fragment and tracking parameters."""
+    parts = urlsplit(url)
+    query = urlencode(
+        [
+            (key, value)
+            for key, value in parse_qsl(parts.query, keep_blank_values=True)
+            if not key.startswith("utm_") and key not in TRACKING_PARAMS
+        ]
+    )
+    return urlunsplit((parts.scheme, parts.netloc.lower(), parts.path, query, ""))
 
-        for result in soup.select(".result"):
-            url = None
-            if link := result.select_one("a.result__a"):
-                url = link.get("href")
-            elif link := result.select_one("a.result__url"):
-                url = link.get("href")
 
-            if url and len(results) < num_results and url.startswith("http"):
-                results.append(url)
+def _result_urls(chunks: Iterable[bytes], num_results: int) -> List[str]:
+    """Pull result links out of a streamed DuckDuckGo results page, stopping once enough are found."""
+    from lxml import etree
 
-        logger.info(f"Found {len(results)} search results")
+    parser = etree.HTMLPullParser(events=("end",), tag="a", encoding="utf-8")
+    results: List[str] = []
+    seen: Set[str] = set()
+
+    for chunk in chunks:
+        parser.feed(chunk)
+        for _, link in parser.read_events():
+            href = link.get("href", "")
+            if not href.startswith("http") or RESULT_LINK_CLASSES.isdisjoint(link.get("class", "").split()):
+                continue
+            if not any("result" in parent.get("class", "").split() for parent in link.iterancestors()):
+                continue
+
+            key = _normalize_url(href)
+            if key in seen or SKIPPED_HOSTS.search(urlsplit(key).hostname or ""):
+                continue
+            seen.add(key)
+            results.append(href)
+            if len(results) == num_results:
+                return results
+
+    return results
+
+
+def _canonical_query(query: str) -> str:
+    """Lower-case a query, collapse its whitespace and drop tokens made only of punctuation."""
+    tokens = query.lower().split()
+    return " ".join(token for token in tokens if not PUNCTUATION_ONLY.fullmatch(token)) or " ".join(tokens)
+
+
+def _in_background(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+    """Run a call on a daemon thread so an unfinished call never holds up interpreter exit."""
+    from concurrent.futures import Future
+
+    future: Future = Future()
+
+    def run() -> None:
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+
+def search_web(query: str, num_results: int = 3) -> List[str]:
+    """Perform a web search and return a list of URLs, reusing recent results for the same query."""
+    import requests
+
+    from cli_search.cache import load_search, save_search
+
+    canonical = _canonical_query(query)
+    logger.debug("Search query %r canonicalized to %r", query, canonical)
+
+    try:
+        if (cached := load_search(canonical, num_results)) is not None:
+            logger.info("Using %d cached search results", len(cached))
+            return cached
+
+        with _session().get(SEARCH_URL, params={"q": canonical}, timeout=SEARCH_TIMEOUT, stream=True) as response:
+            response.raise_for_status()
+            # An early stop leaves the body unread, so closing drops the connection rather than pooling it.
+            results = _result_urls(response.iter_content(16 * 1024), num_results)
+
+        logger.info("Found %d search results", len(results))
+        if results:
+            save_search(canonical, num_results, results)
         return results
-    except Exception as e:
-        logger.error(f"Search error: {str(e)}")
+    except requests.RequestException as e:
+        logger.error("Search error: %s", e)
         return []
 
 
-def fetch_content_and_create_document(url: str) -> Document:
-    """Fetch content from a URL and create a Document object."""
+@cache
+def _visible_text() -> etree.XPath:
+    """Compile the XPath selecting non-blank page text outside script, style and noscript elements."""
+    from lxml import etree
+
+    return etree.XPath(
+        "//text()[normalize-space()][not(ancestor::script or ancestor::style or ancestor::noscript)]",
+        smart_strings=False,
+    )
+
+
+def _page_text(html: bytes, encoding: str) -> str:
+    """Collect the visible text of an HTML page decoded with the given encoding, up to MAX_DOCUMENT_CHARS."""
+    import lxml.html
+
+    parser = lxml.html.HTMLParser(encoding=encoding)
+
+    pieces, size = [], 0
+    for piece in _visible_text()(lxml.html.document_fromstring(html, parser=parser)):
+        piece = WHITESPACE.sub(" ", piece).strip()
+        if not piece:
+            continue
+        pieces.append(piece)
+        size += len(piece) + 1
+        if size > MAX_DOCUMENT_CHARS:
+            break
+
+    return " ".join(pieces)[:MAX_DOCUMENT_CHARS]
+
+
+def _detect_encoding(html: bytes) -> Optional[str]:
+    """Guess the encoding of a page, preferring windows-1252 over equally plausible candidates as browsers do."""
+    import charset_normalizer
+
+    matches = charset_normalizer.from_bytes(html)
+    if (best := matches.best()) is None:
+        return None
+    for match in matches:
+        if match.encoding == "cp1252" and (match.chaos, match.coherence) == (best.chaos, best.coherence):
+            return match.encoding
+    return best.encoding
+
+
+def _parse_html(html: bytes, url: str, charset: Optional[str] = None) -> Document:
+    """Extract the visible text of an HTML page into a Document."""
+    from llama_index.core import Document
+
+    if bom_encoding := next((encoding for bom, encoding in BOMS if html.startswith(bom)), None):
+        html, charset = html.decode(bom_encoding, "replace").encode(), "utf-8"
+    elif not charset and (match := META_CHARSET.search(html, 0, 1024)):
+        charset = match.group(1).decode("ascii")
+
     try:
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",  # noqa: E501
-        }
-        response = requests.get(url, headers=headers, verify=False, timeout=10)
-        response.raise_for_status()
+        text = _page_text(html, charset or "utf-8")
+    except LookupError:
+        logger.debug("Unknown charset %r for %s, falling back to utf-8", charset, url)
+        text = _page_text(html, "utf-8")
+
+    if "\ufffd" in text and (detected := _detect_encoding(html)):
+        logger.debug("Undecodable text in %s, re-decoding as %s", url, detected)
+        text = _page_text(html.decode(detected, "replace").encode(), "utf-8")
+
+    return Document(text=text, metadata={"url": url})
+
 
-        soup = BeautifulSoup(response.text, "html.parser")
+async def _fetch(session: aiohttp.ClientSession, executor: ThreadPoolExecutor, url: str) -> Document:
+    """Fetch a URL, revalidating any cached copy, and parse it in a worker thread."""
+    import asyncio
 
-        for tag in soup(["script", "style", "meta", "link", "noscript"]):
-            tag.decompose()
+    import aiohttp
+    from llama_index.core import Document
 
-        text = soup.get_text(separator=" ", strip=True)
-        text = " ".join(text.split())
-        text = text[:10000]
+    from cli_search.cache import load_page, save_page, touch_page
 
-        return Document(text=text, metadata={"url": url})
+    try:
+        cached = load_page(url)
+        if cached and cached.fresh:
+            return Document(text=cached.text, metadata={"url": url})
+
+        headers = {}
+        if cached and cached.etag:
+            headers["If-None-Match"] = cached.etag
+        if cached and cached.last_modified:
+            headers["If-Modified-Since"] = cached.last_modified
+
+        async with session.get(url, headers=headers, timeout=aiohttp.ClientTimeout(total=10)) as response:
+            if cached and response.status == 304:
+                touch_page(url)
+                return Document(text=cached.text, metadata={"url": url})
+
+            response.raise_for_status()
+            body = bytearray()
+            async for chunk in response.content.iter_chunked(64 * 1024):
+                body += chunk
+                if len(body) >= MAX_PAGE_BYTES:
+                    break
+            etag, last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+            charset = response.charset
+
+        loop = asyncio.get_running_loop()
+        document = await loop.run_in_executor(executor, _parse_html, bytes(body), url, charset)
+        save_page(url, document.text, etag, last_modified)
+        return document
     except Exception as e:
-        logger.warning(f"Error fetching {url}: {str(e)}")
-        return Document(text=f"Failed to fetch content from {url}", metadata={"url": url})
+        logger.warning("Error fetching %s: %s", url, e)
+        return Document(
+            text=f"Failed to fetch content from {url}",
+            metadata={"url": url, "fetch_failed": True},
+            excluded_embed_metadata_keys=["fetch_failed"],
+            excluded_llm_metadata_keys=["fetch_failed"],
+        )
+
+
+async def _gather(urls: List[str]) -> List[Document]:
+    """Fetch all URLs over one shared client session, parsing on a pool sized to the batch."""
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+
+    import aiohttp
+
+    connector = aiohttp.TCPConnector(limit=10, ssl=False)
+    with ThreadPoolExecutor(max_workers=max(1, min(8, len(urls)))) as executor:
+        async with aiohttp.ClientSession(headers=HEADERS, connector=connector) as session:
+            return await asyncio.gather(*(_fetch(session, executor, url) for url in urls))
+
+
+def fetch_documents(urls: List[str]) -> List[Document]:
+    """Fetch the given URLs concurrently and return one Document per URL."""
+    import asyncio
+
+    return asyncio.run(_gather(urls))
 
 
 def search_and_answer(question: str) -> str:
     """Search the web and generate an answer for the given question using LlamaIndex."""
+    question = question.strip()
+    if len(question) < MIN_QUESTION_CHARS:
+        return "Question too short."
+
     if not OPENAI_API_KEY:
         logger.warning("OPENAI_API_KEY not found in environment variables.")
         return "Please set your OPENAI_API_KEY environment variable to use this tool."
 
-    logger.info(f"Processing question: {question}")
+    from cli_search.cache import lookup_answer, store_answer
+
+    logger.info("Processing question: %s", question)
 
     try:
-        Settings.llm = OpenAI(model="gpt-4o", api_key=OPENAI_API_KEY)
-        Settings.node_parser = SentenceSplitter(chunk_size=1024)
+        embed_model = _get_embed_model()
+        question_embedding = embed_model.get_query_embedding(question)
+        if cached_answer := lookup_answer(question_embedding, embed_model.model_name):
+            logger.info("Returning cached answer for a similar question")
+            return cached_answer
 
         logger.info("Searching the web...")
-        urls = search_web(question, num_results=3)
+        search = _in_background(search_web, question, num_results=3)
+
+        import faiss
+        from llama_index.core import QueryBundle, Settings, StorageContext, SummaryIndex, VectorStoreIndex
+        from llama_index.core.query_engine import CitationQueryEngine
+        from llama_index.core.response_synthesizers import ResponseMode
+        from llama_index.vector_stores.faiss import FaissVectorStore
+
+        Settings.embed_model = embed_model
+        Settings.llm = _get_llm()
+        Settings.node_parser = _get_splitter()
+
+        urls = search.result()
 
         if not urls:
             return "I couldn't find any search results for your question."
 
-        logger.info(f"Found URLs: {urls}")
+        logger.info("Found URLs: %s", urls)
 
-        documents = [fetch_content_and_create_document(url) for url in urls]
-        logger.info(f"Created {len(documents)} documents")
+        documents = fetch_documents(urls)
+        logger.info("Created %d documents", len(documents))
 
-        index = VectorStoreIndex.from_documents(documents)
+        if sum(len(document.text) for document in documents) < SMALL_CORPUS_CHARS:
+            index = SummaryIndex.from_documents(documents)
+        else:
+            vector_store = FaissVectorStore(faiss_index=faiss.IndexFlatIP(EMBED_DIM))
+            index = VectorStoreIndex.from_documents(
+                documents,
+                storage_context=StorageContext.from_defaults(vector_store=vector_store),
+                use_async=True,
+            )
 
         query_engine = CitationQueryEngine.from_args(
             index,
             similarity_top_k=3,
             include_text=False,
+            citation_chunk_size=512,
+            response_mode=ResponseMode.COMPACT,
         )
 
         logger.info("Generating answer...")
-        response = query_engine.query(question)
-
-        answer = f"{response.response}\n\nSources:\n"
+        response = query_engine.query(QueryBundle(question, embedding=question_embedding))
 
         unique_sources: Set[str] = set()
         for source_node in response.source_nodes:
             source = source_node.node.metadata.get("url", "Unknown source")
             unique_sources.add(source)
 
-        for i, source in enumerate(unique_sources, 1):
-            answer += f"{i}. {source}\n"
+        sources = "".join(SOURCE_TEMPLATE.format_map({"i": i, "url": url}) for i, url in enumerate(unique_sources, 1))
+        answer = ANSWER_TEMPLATE.format_map({"answer": response.response, "sources": sources})
 
+        if all(source_node.node.metadata.get("fetch_failed") for source_node in response.source_nodes):
+            logger.info("Not caching an answer with no successfully fetched sources")
+        else:
+            store_answer(question, question_embedding, embed_model.model_name, answer)
         return answer
 
     except Exception as e:
-        logger.error(f"Error generating answer: {str(e)}")
+        logger.error("Error generating answer: %s", e)
         return f"I encountered an error while processing your question: {str(e)}"
 
 
@@ -0,0 +1,22 @@
+"""Shared fixtures for the test suite."""
+
+import threading
+import time
+
+import pytest
+
+from cli_search import cache
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "CACHE_DIR", tmp_path)
+    monkeypatch.setattr(cache, "_local", threading.local())
+    return tmp_path
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [time.time()]
+    monkeypatch.setattr(cache.time, "time", lambda: now[0])
+    return now
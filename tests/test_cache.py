@@ -0,0 +1,168 @@
+"""Tests for the on-disk answer, embedding, page and search caches."""
+
+import asyncio
+
+import numpy as np
+
+from cli_search import cache
+
+MODEL = "text-embedding-3-small"
+
+
+def _unit(*components):
+    vector = np.zeros(8, dtype=np.float32)
+    vector[: len(components)] = components
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def test_answer_round_trip():
+    cache.store_answer("what is x", _unit(1, 0), MODEL, "x is y")
+
+    assert cache.lookup_answer(_unit(1, 0), MODEL) == "x is y"
+
+
+def test_answer_lookup_ignores_other_models():
+    cache.store_answer("what is x", _unit(1, 0), MODEL, "x is y")
+
+    assert cache.lookup_answer(_unit(1, 0), "other-model") is None
+
+
+def test_answer_lookup_applies_similarity_threshold():
+    cache.store_answer("what is x", _unit(1, 0), MODEL, "x is y")
+
+    assert cache.lookup_answer(_unit(1, 0.2), MODEL) == "x is y"
+    assert cache.lookup_answer(_unit(1, 0.5), MODEL) is None
+
+
+def test_answer_lookup_picks_the_most_similar_question():
+    cache.store_answer("what is x", _unit(1, 0), MODEL, "x is y")
+    cache.store_answer("what is z", _unit(0, 1), MODEL, "z is w")
+
+    assert cache.lookup_answer(_unit(0.1, 1), MODEL) == "z is w"
+
+
+def test_answers_expire(clock):
+    cache.store_answer("what is x", _unit(1, 0), MODEL, "x is y")
+    clock[0] += cache.ANSWER_TTL + 1
+
+    assert cache.lookup_answer(_unit(1, 0), MODEL) is None
+
+
+def test_embedding_round_trip():
+    cache.save_embeddings({"a": [0.5, 0.25], "b": [1.0, 0.0]})
+
+    assert cache.load_embeddings(["a", "b", "c"]) == {"a": [0.5, 0.25], "b": [1.0, 0.0]}
+
+
+def test_embeddings_expire(clock):
+    cache.save_embeddings({"a": [0.5, 0.25]})
+    clock[0] += cache.EMBEDDING_TTL + 1
+
+    assert cache.load_embeddings(["a"]) == {}
+
+
+def test_embeddings_beyond_the_cap_evict_the_oldest(clock, monkeypatch):
+    monkeypatch.setattr(cache, "MAX_CACHED_EMBEDDINGS", 2)
+    for key in "abc":
+        cache.save_embeddings({key: [1.0]})
+        clock[0] += 1
+
+    assert set(cache.load_embeddings(["a", "b", "c"])) == {"b", "c"}
+
+
+def test_page_round_trip():
+    cache.save_page("https://example.com/", "text", '"etag"', "Mon, 01 Jan 2024 00:00:00 GMT")
+
+    assert cache.load_page("https://example.com/") == cache.CachedPage(
+        "text", '"etag"', "Mon, 01 Jan 2024 00:00:00 GMT", fresh=True
+    )
+    assert cache.load_page("https://example.com/other") is None
+
+
+def test_stale_page_is_kept_until_touched(clock):
+    cache.save_page("https://example.com/", "text", '"etag"', None)
+    clock[0] += cache.PAGE_TTL + 1
+
+    assert cache.load_page("https://example.com/").fresh is False
+
+    cache.touch_page("https://example.com/")
+
+    assert cache.load_page("https://example.com/").fresh is True
+
+
+def test_pages_unused_for_the_retention_period_are_dropped(clock):
+    cache.save_page("https://example.com/old", "old", None, None)
+    clock[0] += cache.PAGE_RETENTION + 1
+    cache.save_page("https://example.com/new", "new", None, None)
+
+    assert cache.load_page("https://example.com/old") is None
+    assert cache.load_page("https://example.com/new").text == "new"
+
+
+def test_search_round_trip():
+    cache.save_search("what is x", 3, ["https://a.example/", "https://b.example/"])
+
+    assert cache.load_search("what is x", 3) == ["https://a.example/", "https://b.example/"]
+    assert cache.load_search("what is x", 5) is None
+
+
+def test_searches_expire(clock):
+    cache.save_search("what is x", 3, ["https://a.example/"])
+    clock[0] += cache.SEARCH_TTL + 1
+
+    assert cache.load_search("what is x", 3) is None
+
+
+def test_async_embeddings_open_and_close_a_client_per_call(monkeypatch):
+    clients = []
+
+    async def fake_aget_embeddings(aclient, texts, engine, **kwargs):
+        clients.append(aclient)
+        return [[float(len(text))] for text in texts]
+
+    monkeypatch.setattr(cache, "aget_embeddings", fake_aget_embeddings)
+    model = cache.CachedEmbedding(api_key="sk-test")
+
+    assert asyncio.run(model._aget_text_embeddings(["a"])) == [[1.0]]
+    assert asyncio.run(model._aget_text_embeddings(["bb"])) == [[2.0]]
+    assert clients[0] is not clients[1]
+    assert all(client.is_closed() for client in clients)
+
+
+def test_cached_embedding_only_embeds_misses(monkeypatch):
+    requested = []
+
+    def fake_get_text_embeddings(self, texts):
+        requested.append(texts)
+        return [[float(len(text))] for text in texts]
+
+    monkeypatch.setattr(cache.OpenAIEmbedding, "_get_text_embeddings", fake_get_text_embeddings)
+    model = cache.CachedEmbedding(api_key="sk-test")
+
+    assert model._get_text_embeddings(["a", "bb"]) == [[1.0], [2.0]]
+    assert model._get_text_embeddings(["bb", "ccc", "a"]) == [[2.0], [3.0], [1.0]]
+    assert model._get_text_embeddings(["a"]) == [[1.0]]
+    assert requested == [["a", "bb"], ["ccc"]]
+
+
+def test_cached_embedding_only_embeds_misses_async(monkeypatch):
+    requested = []
+
+    async def fake_aget_embeddings(aclient, texts, engine, **kwargs):
+        requested.append(texts)
+        return [[float(len(text))] for text in texts]
+
+    monkeypatch.setattr(cache, "aget_embeddings", fake_aget_embeddings)
+    model = cache.CachedEmbedding(api_key="sk-test")
+
+    assert asyncio.run(model._aget_text_embeddings(["a", "bb"])) == [[1.0], [2.0]]
+    assert asyncio.run(model._aget_text_embeddings(["bb", "ccc"])) == [[2.0], [3.0]]
+    assert requested == [["a", "bb"], ["ccc"]]
+
+
+def test_cached_embedding_keys_include_the_model(monkeypatch):
+    monkeypatch.setattr(cache.OpenAIEmbedding, "_get_text_embeddings", lambda self, texts: [[1.0] for _ in texts])
+    cache.CachedEmbedding(api_key="sk-test")._get_text_embeddings(["a"])
+
+    other = cache.CachedEmbedding(model="text-embedding-3-large", api_key="sk-test")
+    assert cache.load_embeddings([other._cache_key("a")]) == {}
@@ -0,0 +1,306 @@
+"""Tests for the search pipeline and the URL, query and HTML helpers behind it."""
+
+import asyncio
+import codecs
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+from llama_index.core import Document, MockEmbedding
+from llama_index.core.llms import MockLLM
+
+from cli_search import cache, main
+from cli_search.main import MAX_DOCUMENT_CHARS, _canonical_query, _normalize_url, _parse_html, _result_urls
+
+RESULTS_PAGE = b"""<html><body>
+<div class="result results_links"><h2><a class="result__a" href="https://a.example/page?utm_source=x">A</a></h2>
+<a class="result__url" href="https://a.example/page">a</a></div>
+<div class="result"><h2><a class="result__a" href="https://www.facebook.com/post">F</a></h2></div>
+<div class="ad"><a class="result__a" href="https://ads.example/">Ad</a></div>
+<div class="result"><h2><a class="result__a" href="/relative">R</a></h2></div>
+<div class="result"><h2><a class="result__a" href="https://b.example/">B</a></h2></div>
+<div class="result"><h2><a class="result__a" href="https://c.example/">C</a></h2></div>
+</body></html>"""
+
+
+class FakeResponse:
+    def __init__(self, status, body=b"", headers=None):
+        self.status, self.body, self.headers, self.charset = status, body, headers or {}, None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    def raise_for_status(self):
+        assert self.status < 400
+
+    @property
+    def content(self):
+        return self
+
+    async def iter_chunked(self, size):
+        yield self.body
+
+
+class FakeSession:
+    def __init__(self, response):
+        self.response, self.requests = response, []
+
+    def get(self, url, headers, timeout):
+        self.requests.append(headers)
+        return self.response
+
+
+class StreamedBody(io.BytesIO):
+    def close(self):
+        self.consumed = self.tell()
+        super().close()
+
+
+class FakeSearchSession:
+    def __init__(self, body):
+        self.body, self.queries, self.raw = body, [], None
+
+    def get(self, url, params, timeout, stream):
+        self.queries.append(params["q"])
+        self.raw = StreamedBody(self.body)
+        response = requests.Response()
+        response.status_code, response.raw = 200, self.raw
+        return response
+
+
+def _fetch(session, url="https://example.com/"):
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return asyncio.run(main._fetch(session, executor, url))
+
+
+@pytest.fixture
+def search_session(monkeypatch):
+    def install(body=RESULTS_PAGE):
+        session = FakeSearchSession(body)
+        monkeypatch.setattr(main, "_session", lambda: session)
+        return session
+
+    return install
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    """Run search_and_answer against mock models and a fixed search result, recording cached answers."""
+    stored = []
+    monkeypatch.setattr(main, "OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(main, "EMBED_DIM", 8)
+    monkeypatch.setattr(main, "_get_embed_model", lambda: MockEmbedding(embed_dim=8))
+    monkeypatch.setattr(main, "_get_llm", lambda: MockLLM(max_tokens=8))
+    monkeypatch.setattr(main, "search_web", lambda query, num_results: ["http://127.0.0.1:9/"])
+    monkeypatch.setattr(cache, "store_answer", lambda *args: stored.append(args))
+    return stored
+
+
+@pytest.mark.parametrize(
+    "url, expected",
+    [
+        ("https://Example.COM/Path?a=1#top", "https://example.com/Path?a=1"),
+        ("https://example.com/?utm_source=x&utm_medium=y&id=3", "https://example.com/?id=3"),
+        ("https://example.com/?fbclid=1&gclid=2", "https://example.com/"),
+        ("https://example.com/?empty=", "https://example.com/?empty="),
+    ],
+)
+def test_normalize_url(url, expected):
+    assert _normalize_url(url) == expected
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [
+        ("  What IS   Python? ", "what is python?"),
+        ("what is python ?", "what is python"),
+        ("- c++ -", "c++"),
+        ("?!", "?!"),
+    ],
+)
+def test_canonical_query(query, expected):
+    assert _canonical_query(query) == expected
+
+
+def test_result_urls_dedupes_and_skips_non_results():
+    urls = _result_urls([RESULTS_PAGE], 5)
+
+    assert urls == ["https://a.example/page?utm_source=x", "https://b.example/", "https://c.example/"]
+
+
+def test_result_urls_stops_at_num_results():
+    assert _result_urls([RESULTS_PAGE], 2) == ["https://a.example/page?utm_source=x", "https://b.example/"]
+
+
+def test_result_urls_keeps_the_original_href():
+    href = "https://a.example/search?flag&q=a%20b"
+    page = f'<div class="result"><a class="result__a" href="{href}">A</a></div>'.encode()
+
+    assert _result_urls([page], 3) == [href]
+
+
+def test_result_urls_handles_small_chunks():
+    chunks = [RESULTS_PAGE[i : i + 7] for i in range(0, len(RESULTS_PAGE), 7)]
+
+    assert _result_urls(chunks, 3) == _result_urls([RESULTS_PAGE], 3)
+
+
+def test_parse_html_keeps_only_visible_text():
+    html = b"""<html><head><title>T</title><style>p {}</style><script>var x;</script></head>
+    <body><p>Hello
+    world</p><noscript>enable js</noscript><div>  again </div></body></html>"""
+
+    document = _parse_html(html, "https://example.com/")
+
+    assert document.text == "T Hello world again"
+    assert document.metadata == {"url": "https://example.com/"}
+
+
+def test_parse_html_truncates_long_pages():
+    html = b"<html><body>" + b"<p>word</p>" * MAX_DOCUMENT_CHARS + b"</body></html>"
+
+    assert len(_parse_html(html, "https://example.com/").text) == MAX_DOCUMENT_CHARS
+
+
+@pytest.mark.parametrize(
+    "html, charset",
+    [
+        ("<html><body><p>café</p></body></html>".encode(), None),
+        ("<html><body><p>café</p></body></html>".encode("latin-1"), "iso-8859-1"),
+        ('<html><head><meta charset="iso-8859-1"></head><body><p>café</p></body></html>'.encode("latin-1"), None),
+        ("<html><body><p>café</p></body></html>".encode(), "unicode"),
+        ('<html><head><meta charset="none"></head><body><p>café</p></body></html>'.encode(), None),
+        ("<html><body><p>café</p></body></html>".encode("utf-16"), None),
+        ("<html><body><p>café</p></body></html>".encode("utf-16"), "iso-8859-1"),
+        (codecs.BOM_UTF8 + "<html><body><p>café</p></body></html>".encode(), None),
+        ("<html><body><p>café</p></body></html>".encode("latin-1"), None),
+        ("<html><body><p>café</p></body></html>".encode("cp1252"), "utf-8"),
+    ],
+)
+def test_parse_html_decodes_charsets(html, charset):
+    assert _parse_html(html, "https://example.com/", charset).text == "café"
+
+
+def test_parse_html_detects_undeclared_legacy_encodings():
+    text = "“Это простой пример текста” – на русском языке, который используется для проверки."
+    html = f"<html><body><p>{text}</p></body></html>".encode("cp1251")
+
+    assert _parse_html(html, "https://example.com/").text == text
+
+
+def test_answers_from_failed_fetches_are_not_cached(pipeline):
+    answer = main.search_and_answer("what is x")
+
+    assert "http://127.0.0.1:9/" in answer
+    assert pipeline == []
+
+
+def test_answers_from_fetched_pages_are_cached(pipeline, monkeypatch):
+    document = Document(text="x is y", metadata={"url": "https://a.example/"})
+    monkeypatch.setattr(main, "fetch_documents", lambda urls: [document])
+
+    answer = main.search_and_answer("what is x")
+
+    assert [args[3] for args in pipeline] == [answer]
+
+
+def test_question_is_embedded_once(pipeline, monkeypatch):
+    queries = []
+    get_query_embedding = MockEmbedding._get_query_embedding
+
+    def counting_query_embedding(self, query):
+        queries.append(query)
+        return get_query_embedding(self, query)
+
+    monkeypatch.setattr(MockEmbedding, "_get_query_embedding", counting_query_embedding)
+    document = Document(text="x is y. " * main.SMALL_CORPUS_CHARS, metadata={"url": "https://a.example/"})
+    monkeypatch.setattr(main, "fetch_documents", lambda urls: [document])
+
+    main.search_and_answer("what is x")
+
+    assert queries == ["what is x"]
+
+
+def test_fetch_parses_and_caches_new_pages():
+    session = FakeSession(FakeResponse(200, b"<html><body><p>fresh text</p></body></html>", {"ETag": '"v1"'}))
+
+    assert _fetch(session).text == "fresh text"
+    assert session.requests == [{}]
+    assert cache.load_page("https://example.com/") == cache.CachedPage("fresh text", '"v1"', None, fresh=True)
+
+
+def test_fetch_serves_fresh_pages_without_a_request():
+    cache.save_page("https://example.com/", "cached text", '"v1"', None)
+    session = FakeSession(FakeResponse(500))
+
+    assert _fetch(session).text == "cached text"
+    assert session.requests == []
+
+
+def test_fetch_revalidates_stale_pages(clock):
+    cache.save_page("https://example.com/", "cached text", '"v1"', "Mon, 01 Jan 2024 00:00:00 GMT")
+    clock[0] += cache.PAGE_TTL + 1
+    session = FakeSession(FakeResponse(304))
+
+    assert _fetch(session).text == "cached text"
+    assert session.requests == [{"If-None-Match": '"v1"', "If-Modified-Since": "Mon, 01 Jan 2024 00:00:00 GMT"}]
+    assert cache.load_page("https://example.com/").fresh is True
+
+
+def test_fetch_failures_return_a_flagged_placeholder():
+    document = _fetch(FakeSession(FakeResponse(500)))
+
+    assert document.text == "Failed to fetch content from https://example.com/"
+    assert document.metadata["fetch_failed"] is True
+
+
+def test_search_web_reuses_cached_results(search_session):
+    session = search_session()
+
+    assert main.search_web("what is x", num_results=2) == ["https://a.example/page?utm_source=x", "https://b.example/"]
+    assert main.search_web("what is x", num_results=2) == ["https://a.example/page?utm_source=x", "https://b.example/"]
+    assert session.queries == ["what is x"]
+
+
+def test_search_web_does_not_cache_empty_results(search_session):
+    session = search_session(b"<html><body>No results.</body></html>")
+
+    assert main.search_web("what is x") == []
+    assert main.search_web("what is x") == []
+    assert session.queries == ["what is x", "what is x"]
+
+
+def test_search_web_canonicalizes_the_query_for_the_request_and_the_cache(search_session):
+    session = search_session()
+
+    main.search_web("  What IS   x ! ", num_results=2)
+    main.search_web("what is x", num_results=2)
+
+    assert session.queries == ["what is x"]
+
+
+def test_search_web_stops_reading_once_enough_results_are_found(search_session):
+    session = search_session(RESULTS_PAGE + b"<p>padding</p>" * 100_000)
+
+    assert main.search_web("what is x", num_results=2) == ["https://a.example/page?utm_source=x", "https://b.example/"]
+    assert session.raw.consumed < len(session.body) // 10
+
+
+@pytest.mark.parametrize("question", ["", "   ", "hi", " ok "])
+def test_short_questions_return_before_any_setup(question, monkeypatch):
+    monkeypatch.setattr(main, "_get_embed_model", lambda: pytest.fail("embedding model built"))
+
+    assert main.search_and_answer(question) == "Question too short."
+
+
+def test_missing_api_key_returns_before_any_setup(monkeypatch):
+    monkeypatch.setattr(main, "OPENAI_API_KEY", None)
+    monkeypatch.setattr(main, "_get_embed_model", lambda: pytest.fail("embedding model built"))
+
+    assert main.search_and_answer("what is x") == (
+        "Please set your OPENAI_API_KEY environment variable to use this tool."
+    )